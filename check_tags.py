@@ -8,9 +8,12 @@ Searches files matching:
 """
 
 import re
-import glob
 import os
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from common import run_captured, walk_files
 
 # Allowed tags list
 ALLOWED_TAGS = {
@@ -42,33 +45,24 @@ ALLOWED_TAGS = {
     "[breaking slightly]"
 }
 
-# Lowercase version for case-insensitive matching
-ALLOWED_TAGS_LOWER = {tag.lower() for tag in ALLOWED_TAGS}
+# Lowercased tag bodies (brackets stripped) for case-insensitive matching
+# directly against the regex capture group
+_ALLOWED = frozenset(tag[1:-1].lower() for tag in ALLOWED_TAGS)
 
+# [something] at the very end of a line (possibly with trailing whitespace).
+# Multiline and newline-free so it can scan a whole raw file buffer at once;
+# the tags are ASCII-delimited, so files can be scanned without decoding them
+_END_TAG_BYTES_RE = re.compile(rb'\[([^\]\n]+)\][^\S\n]*$', re.MULTILINE)
 
-def find_target_files(base_path="/workspace/multilingual_fun_lines/actor_lines"):
-    """Find all target files matching the pattern (numbered.txt but not tag_match)."""
-    target_files = []
-    
-    # Search for all *_lines_numbered.txt files recursively
-    pattern = os.path.join(base_path, "**", "*_lines_numbered.txt")
-    all_files = glob.glob(pattern, recursive=True)
-    
-    # Filter out files with "tag_match" in the name
-    for f in all_files:
-        if "tag_match" not in os.path.basename(f):
-            target_files.append(f)
-    
-    return sorted(target_files)
 
+def _is_target(name):
+    """Whether a file name is a target: *_lines_numbered.txt, not tag_match."""
+    return name.endswith('_lines_numbered.txt') and 'tag_match' not in name
 
-def extract_end_tag(line):
-    """Extract tag at end of line if present."""
-    # Match [something] at the very end of the line (possibly with trailing whitespace)
-    match = re.search(r'\[([^\]]+)\]\s*$', line)
-    if match:
-        return f"[{match.group(1)}]"
-    return None
+
+def find_target_files(base_path="/workspace/multilingual_fun_lines/actor_lines"):
+    """Find all target files matching the pattern (numbered.txt but not tag_match)."""
+    return sorted(walk_files(base_path, _is_target))
 
 
 def process_file(filepath):
@@ -76,16 +70,26 @@ def process_file(filepath):
     unlisted = []
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.rstrip('\n')
-                tag = extract_end_tag(line)
-                if tag:
-                    # Check if tag is NOT in allowed list (case-insensitive)
-                    if tag.lower() not in ALLOWED_TAGS_LOWER:
-                        unlisted.append((line_num, tag))
+        with open(filepath, 'rb') as f:
+            data = f.read()
     except Exception as e:
         print(f"Error reading {filepath}: {e}")
+        return unlisted
+    
+    # Text mode would have turned \r\n and lone \r into \n
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    
+    # Scan the whole buffer in one go; line numbers are recovered by counting
+    # the newlines between consecutive matches. Only tag bodies get decoded.
+    line_num, pos = 1, 0
+    for m in _END_TAG_BYTES_RE.finditer(data):
+        line_num += data.count(b'\n', pos, m.start())
+        pos = m.start()
+        # Check if tag is NOT in allowed list (case-insensitive)
+        body = m.group(1).decode('utf-8', 'replace')
+        if body.lower() not in _ALLOWED:
+            unlisted.append((line_num, '[' + body + ']'))
     
     return unlisted
 
@@ -121,51 +125,58 @@ def main():
     
     # Collect all unlisted tags
     all_unlisted = []  # List of (filepath, line_num, tag)
-    tag_counts = {}    # Count of each unique unlisted tag
+    tag_counts = Counter()  # Count of each unique unlisted tag
     
-    for filepath in target_files:
-        unlisted = process_file(filepath)
-        for line_num, tag in unlisted:
-            all_unlisted.append((filepath, line_num, tag))
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+    with ProcessPoolExecutor() as ex:
+        results = list(ex.map(run_captured, repeat(process_file), target_files, chunksize=4))
+    
+    for filepath, (unlisted, output) in zip(target_files, results):
+        print(output, end='')
+        all_unlisted.extend((filepath, line_num, tag) for line_num, tag in unlisted)
+        tag_counts.update(tag for _, tag in unlisted)
     
     # Output results
     print(f"\nFound {len(all_unlisted)} instances of unlisted tags at end of lines")
     print(f"Unique unlisted tags: {len(tag_counts)}")
     print("-" * 60)
     
+    # Rank once by count; both the console and the report summary use it
+    ranked = tag_counts.most_common()
+    
     # Print summary of unique tags
     if tag_counts:
         print("\nUnlisted tags found (sorted by count):")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
+        for tag, count in ranked:
             print(f"  {tag}: {count} occurrences")
     
-    # Write detailed results to file
+    # Build the detailed report in memory and write it in one call
+    out = [
+        "# Tags at end of lines NOT in allowed list\n",
+        f"# Total instances: {len(all_unlisted)}\n",
+        f"# Unique tags: {len(tag_counts)}\n",
+        "#" + "=" * 59 + "\n\n",
+    ]
+    
+    # Summary section
+    out.append("## SUMMARY - Unique unlisted tags:\n")
+    out.extend(f"  {tag}: {count} occurrences\n"
+               for tag, count in ranked)
+    out.append("\n" + "=" * 60 + "\n\n")
+    
+    # Detailed locations
+    out.append("## DETAILED LOCATIONS:\n\n")
+    
+    # Group by file: the per-file results are already grouped, in sorted
+    # file order and ascending line order
+    for filepath, (unlisted, _) in zip(target_files, results):
+        if not unlisted:
+            continue
+        out.append(f"### {filepath}\n")
+        out.extend(f"  Line {line_num}: {tag}\n" for line_num, tag in unlisted)
+        out.append("\n")
+    
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write("# Tags at end of lines NOT in allowed list\n")
-        f.write(f"# Total instances: {len(all_unlisted)}\n")
-        f.write(f"# Unique tags: {len(tag_counts)}\n")
-        f.write("#" + "=" * 59 + "\n\n")
-        
-        # Summary section
-        f.write("## SUMMARY - Unique unlisted tags:\n")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
-            f.write(f"  {tag}: {count} occurrences\n")
-        f.write("\n" + "=" * 60 + "\n\n")
-        
-        # Detailed locations
-        f.write("## DETAILED LOCATIONS:\n\n")
-        
-        # Group by file
-        by_file = defaultdict(list)
-        for filepath, line_num, tag in all_unlisted:
-            by_file[filepath].append((line_num, tag))
-        
-        for filepath in sorted(by_file.keys()):
-            f.write(f"### {filepath}\n")
-            for line_num, tag in sorted(by_file[filepath]):
-                f.write(f"  Line {line_num}: {tag}\n")
-            f.write("\n")
+        f.write("".join(out))
     
     print(f"\nDetailed results written to: {output_file}")
 
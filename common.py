@@ -0,0 +1,47 @@
+"""
+Helpers shared by the tag scripts.
+"""
+
+import io
+import os
+from contextlib import redirect_stdout
+
+
+def walk_files(root, keep, _seen=None):
+    """Recursively yield paths of files under root whose names pass keep(name).
+
+    Like glob's "**", hidden entries are skipped, symlinked directories are
+    followed and a missing root yields nothing. A directory reached twice
+    through symlinks is only walked once, under the path that comes first
+    when entries are visited in name order.
+    """
+    if _seen is None:
+        _seen = set()
+    try:
+        st = os.stat(root)
+    except OSError:
+        return
+    if (st.st_dev, st.st_ino) in _seen:
+        return
+    _seen.add((st.st_dev, st.st_ino))
+    try:
+        with os.scandir(root) as it:
+            # Sorted, so the same path wins for a shared directory on every run
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+    for e in entries:
+        if e.name.startswith('.'):
+            continue
+        if e.is_dir():
+            yield from walk_files(e.path, keep, _seen)
+        elif keep(e.name) and e.is_file():
+            yield e.path
+
+
+def run_captured(func, *args):
+    """Call func(*args) with stdout captured; returns (result, printed output)."""
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        result = func(*args)
+    return result, buf.getvalue()
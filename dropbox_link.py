@@ -1,14 +1,26 @@
 #!/usr/bin/env python3
+import os
 import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
+from common import run_captured
+
+# The link sits at the top of the base file, so only this much is scanned
+LINK_SCAN_CHARS = 2048
+_DROPBOX_RE = re.compile(r'https://www\.dropbox\.com/\S+')
+
 def extract_dropbox_link(filepath):
     """Extract Dropbox link from the top of a file"""
     with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
+        # Finish the line the read limit cuts into, so a link is never split
+        head = f.read(LINK_SCAN_CHARS) + f.readline()
     
     # Look for Dropbox link
-    match = re.search(r'https://www\.dropbox\.com/[^\s]+', content)
+    match = _DROPBOX_RE.search(head)
     if match:
         return match.group(0)
     return None
@@ -23,15 +35,60 @@ def add_link_to_file(filepath, link):
         print(f"    Link already present in {filepath.name}")
         return False
     
-    # Add link at the top
-    new_content = f"{link}\n\n{content}"
-    
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(new_content)
+    # Add link at the top: write into a temp file next to the original and
+    # swap it in, so the file is never left half-written
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False,
+                                         dir=filepath.parent) as tmp:
+            tmp_path = tmp.name
+            tmp.write(f"{link}\n\n")
+            tmp.write(content)
+        shutil.copymode(filepath, tmp_path)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
     
     print(f"    Added link to {filepath.name}")
     return True
 
+def process_actor_dir(actor_dir):
+    """Add the Dropbox link to one actor folder's numbered and annotated files"""
+    print(f"\nProcessing {actor_dir.name}:")
+    
+    # Find the base tag_match file (without _numbered or _annotated)
+    base_files = list(actor_dir.glob("new_order_tag_match_*_lines.txt"))
+    # Filter out numbered and annotated versions
+    base_files = [f for f in base_files if '_numbered' not in f.name and '_annotated' not in f.name]
+    
+    if not base_files:
+        print(f"  No base tag_match file found")
+        return
+    
+    base_file = base_files[0]
+    print(f"  Base file: {base_file.name}")
+    
+    # Extract Dropbox link
+    link = extract_dropbox_link(base_file)
+    if not link:
+        print(f"  No Dropbox link found in {base_file.name}")
+        return
+    
+    print(f"  Found link: {link[:60]}...")
+    
+    # Find numbered and annotated versions
+    stem = base_file.stem  # e.g., "new_order_tag_match_de_f_lines"
+    numbered_file = actor_dir / f"{stem}_numbered.txt"
+    annotated_file = actor_dir / f"{stem}_annotated.txt"
+    
+    for target_file in [numbered_file, annotated_file]:
+        if target_file.exists():
+            add_link_to_file(target_file, link)
+        else:
+            print(f"    File not found: {target_file.name}")
+
 def main():
     base_dir = Path("/workspace/multilingual_fun_lines/actor_lines")
     
@@ -39,46 +96,13 @@ def main():
         print(f"Error: {base_dir} does not exist")
         return
     
-    for actor_dir in sorted(base_dir.iterdir()):
-        if not actor_dir.is_dir():
-            continue
-        
-        # Skip English folders (they don't have tag_match files)
-        if actor_dir.name.startswith('english_'):
-            continue
-        
-        print(f"\nProcessing {actor_dir.name}:")
-        
-        # Find the base tag_match file (without _numbered or _annotated)
-        base_files = list(actor_dir.glob("new_order_tag_match_*_lines.txt"))
-        # Filter out numbered and annotated versions
-        base_files = [f for f in base_files if '_numbered' not in f.name and '_annotated' not in f.name]
-        
-        if not base_files:
-            print(f"  No base tag_match file found")
-            continue
-        
-        base_file = base_files[0]
-        print(f"  Base file: {base_file.name}")
-        
-        # Extract Dropbox link
-        link = extract_dropbox_link(base_file)
-        if not link:
-            print(f"  No Dropbox link found in {base_file.name}")
-            continue
-        
-        print(f"  Found link: {link[:60]}...")
-        
-        # Find numbered and annotated versions
-        stem = base_file.stem  # e.g., "new_order_tag_match_de_f_lines"
-        numbered_file = actor_dir / f"{stem}_numbered.txt"
-        annotated_file = actor_dir / f"{stem}_annotated.txt"
-        
-        for target_file in [numbered_file, annotated_file]:
-            if target_file.exists():
-                add_link_to_file(target_file, link)
-            else:
-                print(f"    File not found: {target_file.name}")
+    # Skip English folders (they don't have tag_match files)
+    actor_dirs = [d for d in sorted(base_dir.iterdir())
+                  if d.is_dir() and not d.name.startswith('english_')]
+    
+    with ProcessPoolExecutor() as ex:
+        for _, output in ex.map(run_captured, repeat(process_actor_dir), actor_dirs):
+            print(output, end='')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,69 +1,104 @@
 import os
 import glob
 import re
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-# Find all matching files
 base_dir = "/workspace/multilingual_fun_lines/actor_lines"
-pattern = os.path.join(base_dir, "*/new_order_*_lines_numbered.txt")
-found_files = glob.glob(pattern)
+output_path = "/workspace/multilingual_fun_lines/end_of_line_tags_report.txt"
 
-# Filter out "original" and "tag_match" versions
-found_files = [f for f in found_files if "original" not in f and "tag_match" not in f]
+# Regex for tags at end of line (multiline, so it runs over a whole file
+# buffer). Bytes, since tags are ASCII-delimited and files needn't be decoded.
+end_tag_pattern = re.compile(rb'\[([^\]\n]+)\][^\S\n]*$', re.MULTILINE)
 
-# Regex for tags at end of line
-end_tag_pattern = re.compile(r'\[([^\]]+)\]\s*$')
+# Number of example lines shown per tag in the report
+SAMPLES_PER_TAG = 3
 
-# Track all tags and where they appear
-all_tags = defaultdict(list)
-tags_by_file = defaultdict(lambda: defaultdict(int))
 
-for filepath in sorted(found_files):
-    lang_folder = filepath.split("/")[-2]
+def scan_file(filepath):
+    """Return (tag, line_num, line) for every end-of-line tag in a file."""
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    # Text mode would have turned \r\n and lone \r into \n
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
     
-    with open(filepath, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.rstrip('\n')
-            match = end_tag_pattern.search(line)
-            if match:
-                tag = match.group(1).lower()
-                all_tags[tag].append((lang_folder, line_num, line))
-                tags_by_file[lang_folder][tag] += 1
+    found = []
+    # Jump straight to the tagged lines; line numbers come from counting the
+    # newlines skipped since the previous match. Only tagged lines get decoded.
+    line_num, pos = 1, 0
+    for match in end_tag_pattern.finditer(data):
+        line_start = data.rfind(b'\n', 0, match.start()) + 1
+        line_num += data.count(b'\n', pos, line_start)
+        pos = line_start
+        line_end = data.find(b'\n', line_start)
+        line = data[line_start:line_end] if line_end != -1 else data[line_start:]
+        found.append((match.group(1).decode('utf-8', 'replace').lower(), line_num,
+                      line.decode('utf-8', 'replace')))
+    return found
 
-# Write results to file
-output_path = "/workspace/multilingual_fun_lines/end_of_line_tags_report.txt"
 
-with open(output_path, 'w', encoding='utf-8') as out:
-    out.write("=" * 80 + "\n")
-    out.write("END-OF-LINE TAGS FOUND\n")
-    out.write("=" * 80 + "\n")
+def main():
+    # Find all matching files
+    pattern = os.path.join(base_dir, "*/new_order_*_lines_numbered.txt")
+    found_files = glob.glob(pattern)
     
-    out.write(f"\nUnique tags: {len(all_tags)}\n")
-    out.write("\nAll tags (sorted by frequency):\n")
-    for tag, occurrences in sorted(all_tags.items(), key=lambda x: -len(x[1])):
-        out.write(f"  [{tag}]\n")
+    # Filter out "original" and "tag_match" versions
+    found_files = sorted(f for f in found_files if "original" not in f and "tag_match" not in f)
     
-    out.write("\n" + "=" * 80 + "\n")
-    out.write("TAGS BY LANGUAGE/FILE\n")
-    out.write("=" * 80 + "\n")
+    # Track how often each tag appears, plus only the first few lines it
+    # appears on; the report never looks at the rest
+    tag_counts = Counter()
+    samples = defaultdict(list)
+    tags_by_file = defaultdict(lambda: defaultdict(int))
     
-    for lang in sorted(tags_by_file.keys()):
-        tags = tags_by_file[lang]
-        total = sum(tags.values())
-        out.write(f"\n{lang} ({total} total):\n")
-        for tag, count in sorted(tags.items(), key=lambda x: -x[1]):
-            out.write(f"  [{tag}]: {count}\n")
+    with ProcessPoolExecutor() as ex:
+        results = list(ex.map(scan_file, found_files, chunksize=4))
     
-    out.write("\n" + "=" * 80 + "\n")
-    out.write("SAMPLE LINES FOR EACH TAG\n")
-    out.write("=" * 80 + "\n")
+    for filepath, found in zip(found_files, results):
+        lang_folder = filepath.split("/")[-2]
+        for tag, line_num, line in found:
+            tag_counts[tag] += 1
+            if len(samples[tag]) < SAMPLES_PER_TAG:
+                samples[tag].append((lang_folder, line_num, line))
+            tags_by_file[lang_folder][tag] += 1
     
-    for tag in sorted(all_tags.keys()):
-        out.write(f"\n[{tag}]  :\n")
-        for lang, line_num, line_text in all_tags[tag][:3]:
-            display = line_text if len(line_text) < 100 else line_text[:97] + "..."
-            out.write(f"  {lang}:{line_num} -> {display}\n")
-        if len(all_tags[tag]) > 3:
-            out.write(f"  ... and {len(all_tags[tag]) - 3} more\n")
+    # Write results to file
+    with open(output_path, 'w', encoding='utf-8') as out:
+        out.write("=" * 80 + "\n")
+        out.write("END-OF-LINE TAGS FOUND\n")
+        out.write("=" * 80 + "\n")
+        
+        out.write(f"\nUnique tags: {len(tag_counts)}\n")
+        out.write("\nAll tags (sorted by frequency):\n")
+        for tag, _ in tag_counts.most_common():
+            out.write(f"  [{tag}]\n")
+        
+        out.write("\n" + "=" * 80 + "\n")
+        out.write("TAGS BY LANGUAGE/FILE\n")
+        out.write("=" * 80 + "\n")
+        
+        for lang in sorted(tags_by_file.keys()):
+            tags = tags_by_file[lang]
+            total = sum(tags.values())
+            out.write(f"\n{lang} ({total} total):\n")
+            for tag, count in sorted(tags.items(), key=lambda x: -x[1]):
+                out.write(f"  [{tag}]: {count}\n")
+        
+        out.write("\n" + "=" * 80 + "\n")
+        out.write("SAMPLE LINES FOR EACH TAG\n")
+        out.write("=" * 80 + "\n")
+        
+        for tag in sorted(tag_counts.keys()):
+            out.write(f"\n[{tag}]  :\n")
+            for lang, line_num, line_text in samples[tag]:
+                display = line_text if len(line_text) < 100 else line_text[:97] + "..."
+                out.write(f"  {lang}:{line_num} -> {display}\n")
+            if tag_counts[tag] > SAMPLES_PER_TAG:
+                out.write(f"  ... and {tag_counts[tag] - SAMPLES_PER_TAG} more\n")
+    
+    print(f"Report saved to: {output_path}")
+
 
-print(f"Report saved to: {output_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -7,46 +7,29 @@ This is for discovery - listing all unique tags that appear at the start of line
 """
 
 import re
-import glob
 import os
-from collections import defaultdict
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+from common import run_captured, walk_files
 
-def find_target_files(base_path="/workspace/multilingual_fun_lines/actor_lines"):
-    """Find all target files matching the pattern (_lines.txt but not _lines_numbered.txt and not tag_match)."""
-    target_files = []
-    
-    # Search for all *_lines.txt files recursively
-    pattern = os.path.join(base_path, "**", "*_lines.txt")
-    all_files = glob.glob(pattern, recursive=True)
-    
-    # Filter out files with "tag_match" in the name or "_lines_numbered" in the name
-    for f in all_files:
-        basename = os.path.basename(f)
-        if "tag_match" not in basename and "_lines_numbered" not in basename:
-            target_files.append(f)
-    
-    return sorted(target_files)
+# "123. [tag] ..." -> dialogue number, separator and tag body in one match.
+# The number only counts as a dialogue number when whitespace follows the
+# dot, so the separator is captured separately.
+# Multiline and newline-free so it can scan a whole raw file buffer at once;
+# numbers and brackets are ASCII, so files can be scanned without decoding them
+_START_BYTES_RE = re.compile(rb'^(\d+)\.([^\S\n]*)\[([^\]\n]+)\]', re.MULTILINE)
 
 
-def extract_start_tag(line):
-    """
-    Extract tag at start of dialogue line if present.
-    Pattern: "123. [tag] text..." -> returns "[tag]"
-    """
-    # Match: number. [something] at the start
-    match = re.match(r'^(\d+)\.\s*\[([^\]]+)\]', line)
-    if match:
-        return f"[{match.group(2)}]"
-    return None
+def _is_target(name):
+    """Whether a file name is a target: *_lines.txt, not tag_match, not _lines_numbered."""
+    return name.endswith('_lines.txt') and 'tag_match' not in name and '_lines_numbered' not in name
 
 
-def extract_dialogue_number(line):
-    """Extract dialogue number from start of line (e.g., '1.', '2.', '376.')"""
-    match = re.match(r'^(\d+)\.\s', line)
-    if match:
-        return match.group(1)
-    return None
+def find_target_files(base_path="/workspace/multilingual_fun_lines/actor_lines"):
+    """Find all target files matching the pattern (_lines.txt but not _lines_numbered.txt and not tag_match)."""
+    return sorted(walk_files(base_path, _is_target))
 
 
 def process_file(filepath):
@@ -54,15 +37,24 @@ def process_file(filepath):
     found = []
     
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for file_line_num, line in enumerate(f, 1):
-                line = line.rstrip('\n')
-                tag = extract_start_tag(line)
-                if tag:
-                    dialogue_num = extract_dialogue_number(line)
-                    found.append((file_line_num, dialogue_num, tag))
+        with open(filepath, 'rb') as f:
+            data = f.read()
     except Exception as e:
         print(f"Error reading {filepath}: {e}")
+        return found
+    
+    # Text mode would have turned \r\n and lone \r into \n
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    
+    # Scan the whole buffer in one go; line numbers are recovered by counting
+    # the newlines between consecutive matches. Only matched parts get decoded.
+    file_line_num, pos = 1, 0
+    for m in _START_BYTES_RE.finditer(data):
+        file_line_num += data.count(b'\n', pos, m.start())
+        pos = m.start()
+        dialogue_num = m.group(1).decode('ascii') if m.group(2) else None
+        found.append((file_line_num, dialogue_num, f"[{m.group(3).decode('utf-8', 'replace')}]"))
     
     return found
 
@@ -98,59 +90,67 @@ def main():
     
     # Collect all tags
     all_found = []  # List of (filepath, file_line_num, dialogue_num, tag)
-    tag_counts = {}    # Count of each unique tag
+    tag_counts = Counter()  # Count of each unique tag
     
-    for filepath in target_files:
-        found = process_file(filepath)
-        for file_line_num, dialogue_num, tag in found:
-            all_found.append((filepath, file_line_num, dialogue_num, tag))
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+    with ProcessPoolExecutor() as ex:
+        results = list(ex.map(run_captured, repeat(process_file), target_files, chunksize=4))
+    
+    for filepath, (found, output) in zip(target_files, results):
+        print(output, end='')
+        all_found.extend((filepath, file_line_num, dialogue_num, tag)
+                         for file_line_num, dialogue_num, tag in found)
+        tag_counts.update(tag for _, _, tag in found)
     
     # Output results
     print(f"\nFound {len(all_found)} total START tags")
     print(f"Unique START tags: {len(tag_counts)}")
     print("-" * 60)
     
+    # Rank once by count; both the console and the report summary use it
+    ranked = tag_counts.most_common()
+    
     # Print summary of unique tags
     if tag_counts:
         print("\nALL unique START tags (sorted by count):")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
+        for tag, count in ranked:
             print(f"  {tag}: {count} occurrences")
     
-    # Write detailed results to file
+    # Build the detailed report in memory and write it in one call
+    out = [
+        "# ALL tags at START of dialogue lines\n",
+        f"# Total instances: {len(all_found)}\n",
+        f"# Unique tags: {len(tag_counts)}\n",
+        "#" + "=" * 59 + "\n\n",
+    ]
+    
+    # Summary section - just the unique tags sorted by count
+    out.append("## ALL UNIQUE START TAGS (sorted by count):\n")
+    out.extend(f"  {tag}: {count}\n"
+               for tag, count in ranked)
+    out.append("\n" + "=" * 60 + "\n\n")
+    
+    # Alphabetical list for easy reference
+    out.append("## ALL UNIQUE START TAGS (alphabetical):\n")
+    out.extend(f"  {tag}\n" for tag in sorted(tag_counts.keys(), key=lambda x: x.lower()))
+    out.append("\n" + "=" * 60 + "\n\n")
+    
+    # Detailed locations
+    out.append("## DETAILED LOCATIONS:\n")
+    out.append("# Format: File path | File line | Dialogue # | Tag\n\n")
+    
+    # Group by file: the per-file results are already grouped, in sorted
+    # file order and ascending line order
+    for filepath, (found, _) in zip(target_files, results):
+        if not found:
+            continue
+        out.append(f"### {filepath}\n")
+        for file_line_num, dialogue_num, tag in found:
+            dialogue_str = f"Dialogue {dialogue_num}" if dialogue_num else "N/A"
+            out.append(f"  Line {file_line_num} | {dialogue_str} | {tag}\n")
+        out.append("\n")
+    
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write("# ALL tags at START of dialogue lines\n")
-        f.write(f"# Total instances: {len(all_found)}\n")
-        f.write(f"# Unique tags: {len(tag_counts)}\n")
-        f.write("#" + "=" * 59 + "\n\n")
-        
-        # Summary section - just the unique tags sorted by count
-        f.write("## ALL UNIQUE START TAGS (sorted by count):\n")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
-            f.write(f"  {tag}: {count}\n")
-        f.write("\n" + "=" * 60 + "\n\n")
-        
-        # Alphabetical list for easy reference
-        f.write("## ALL UNIQUE START TAGS (alphabetical):\n")
-        for tag in sorted(tag_counts.keys(), key=lambda x: x.lower()):
-            f.write(f"  {tag}\n")
-        f.write("\n" + "=" * 60 + "\n\n")
-        
-        # Detailed locations
-        f.write("## DETAILED LOCATIONS:\n")
-        f.write("# Format: File path | File line | Dialogue # | Tag\n\n")
-        
-        # Group by file
-        by_file = defaultdict(list)
-        for filepath, file_line_num, dialogue_num, tag in all_found:
-            by_file[filepath].append((file_line_num, dialogue_num, tag))
-        
-        for filepath in sorted(by_file.keys()):
-            f.write(f"### {filepath}\n")
-            for file_line_num, dialogue_num, tag in sorted(by_file[filepath]):
-                dialogue_str = f"Dialogue {dialogue_num}" if dialogue_num else "N/A"
-                f.write(f"  Line {file_line_num} | {dialogue_str} | {tag}\n")
-            f.write("\n")
+        f.write("".join(out))
     
     print(f"\nDetailed results written to: {output_file}")
 
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 import re
 import os
+import shutil
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
+from common import run_captured
+
 # Map section headers to content type tags
 SECTION_TO_TAG = {
     'DIALOGUE': 'dialogue',
@@ -16,32 +22,47 @@ SECTION_TO_TAG = {
 # Mode tags (language modes for non-English files)
 MODE_TAGS = {'pure', 'mix', 'en'}
 
-def parse_line_with_inline_tag(line):
-    """Extract line number and tag from a line like '16. [customer_support|professional] ...'"""
-    match = re.match(r'^(\d+)\.\s*\[([^\]]+)\]', line.strip())
-    if match:
-        line_num = int(match.group(1))
-        tag = match.group(2)
-        # Check if this is a content type tag (not a mode tag)
-        base_tag = tag.split('|')[0]
-        if base_tag not in MODE_TAGS:
-            return line_num, tag
-    return None, None
+# Finds every numbered line ("16." with an optional leading "[tag]") and
+# every section header ("# --- DIALOGUE ---") in a whole file buffer.
+# Leading whitespace is allowed and no part may cross a newline, so each
+# match describes exactly one line.
+_LINE_RE = re.compile(
+    r'^[^\S\n]*(?:'
+    r'(\d+)\.(?:[^\S\n]*\[([^\]\n]+)\])?'
+    r'|#[^\S\n]*---[^\S\n]*(\w+)(?:[^\S\n]*\(continued\))?[^\S\n]*---'
+    r')',
+    re.MULTILINE,
+)
+# Line number prefix of a numbered line; matched at a line start offset
+_NUM_PREFIX_RE = re.compile(r'(\d+\.)\s*')
 
-def parse_line_number(line):
-    """Extract just the line number from a numbered line"""
-    match = re.match(r'^(\d+)\.', line.strip())
-    if match:
-        return int(match.group(1))
-    return None
+# Existing header block: starts with "# Use these" and ends before "# --- "
+_HEADER_RE = re.compile(r'# Use these.*?(?=\n# ---)', re.DOTALL)
+# Alternate layout with a "# LINE INDEX" title line
+_HEADER_RE2 = re.compile(r'# LINE INDEX\n# Use these.*?(?=\n#\n# ---|\n# --- )', re.DOTALL)
 
-def parse_section_header(line):
-    """Extract section name from a header like '# --- DIALOGUE ---'"""
-    match = re.match(r'^#\s*---\s*(\w+)(?:\s*\(continued\))?\s*---', line.strip())
-    if match:
-        section = match.group(1).upper()
-        return SECTION_TO_TAG.get(section)
-    return None
+def scan_lines(content):
+    """Yield (section, line_num, content type tag, line start offset) for each header or numbered line"""
+    for match in _LINE_RE.finditer(content):
+        line_num, tag, section = match.group(1, 2, 3)
+        if line_num is not None:
+            # Check if this is a content type tag (not a mode tag)
+            if tag is not None and tag.split('|')[0] in MODE_TAGS:
+                tag = None
+            yield None, int(line_num), tag, match.start()
+        else:
+            yield SECTION_TO_TAG.get(section.upper()), None, None, match.start()
+
+def render(content, header_spans, header_text, edits):
+    """Yield content in pieces with header_spans replaced by header_text and (start, end, text) edits applied"""
+    pos = 0
+    for start, end, text in sorted([(s, e, header_text) for s, e in header_spans] + edits):
+        if start < pos:
+            continue
+        yield content[pos:start]
+        yield text
+        pos = end
+    yield content[pos:]
 
 def ranges_to_string(numbers):
     """Convert a list of numbers to a range string like '1-20, 31-40, 45'"""
@@ -100,22 +121,16 @@ def process_file(filepath, add_inline_tags=False):
     with open(filepath, 'r', encoding='utf-8') as f:
         content = f.read()
     
-    lines = content.split('\n')
+    # Classify every line once; the passes below only look at these results
+    parsed = list(scan_lines(content))
     
     content_types = defaultdict(list)
     professionalism = defaultdict(list)
     total_lines = 0
     
-    # First pass: check if file uses inline tags or section headers
-    has_inline_tags = False
-    has_section_headers = False
-    
-    for line in lines:
-        if parse_section_header(line):
-            has_section_headers = True
-        line_num, tag = parse_line_with_inline_tag(line)
-        if line_num and tag:
-            has_inline_tags = True
+    # Check if file uses inline tags or section headers
+    has_inline_tags = any(line_num and tag for _, line_num, tag, _ in parsed)
+    has_section_headers = any(section for section, _, _, _ in parsed)
     
     # Determine file type and parse accordingly
     current_section = None
@@ -123,9 +138,8 @@ def process_file(filepath, add_inline_tags=False):
     
     if has_inline_tags and not has_section_headers:
         # English-style file with inline tags like [dialogue]
-        for line in lines:
-            line_num, tag = parse_line_with_inline_tag(line)
-            if line_num is not None:
+        for _, line_num, tag, _ in parsed:
+            if tag is not None:
                 total_lines = max(total_lines, line_num)
                 
                 if '|' in tag:
@@ -136,13 +150,11 @@ def process_file(filepath, add_inline_tags=False):
                     content_types[tag].append(line_num)
     else:
         # Non-English file with section headers like # --- DIALOGUE ---
-        for line in lines:
-            section = parse_section_header(line)
+        for section, line_num, _, _ in parsed:
             if section:
                 current_section = section
                 continue
             
-            line_num = parse_line_number(line)
             if line_num is not None and current_section:
                 total_lines = max(total_lines, line_num)
                 content_types[current_section].append(line_num)
@@ -155,54 +167,51 @@ def process_file(filepath, add_inline_tags=False):
     # Generate new header
     new_header = generate_header(content_types, professionalism, total_lines)
     
-    # If requested, add inline content type tags to each line
-    new_lines = []
+    # If requested, add inline content type tags to each line. These are
+    # collected as edits to the line number prefixes and applied on output.
+    edits = []
     if add_inline_tags and line_to_section:
-        current_section = None
-        for line in lines:
-            section = parse_section_header(line)
-            if section:
-                current_section = section
-                new_lines.append(line)
+        for _, line_num, _, start in parsed:
+            if line_num is None or line_num not in line_to_section:
                 continue
-            
-            line_num = parse_line_number(line)
-            if line_num is not None and line_num in line_to_section:
-                content_tag = line_to_section[line_num]
-                # Check if line already has the content tag
-                if f'[{content_tag}]' not in line and f'[{content_tag}|' not in line:
-                    # Insert content tag after the line number
-                    # Pattern: "1. [mix] text" -> "1. [dialogue] [mix] text"
-                    new_line = re.sub(
-                        r'^(\d+\.)\s*',
-                        rf'\1 [{content_tag}] ',
-                        line
-                    )
-                    new_lines.append(new_line)
-                else:
-                    new_lines.append(line)
-            else:
-                new_lines.append(line)
-        content = '\n'.join(new_lines)
-    
-    # Find and replace the old header
-    # Look for the block starting with "# Use these" and ending before "# --- "
-    header_pattern = r'# Use these.*?(?=\n# ---)'
-    
-    if re.search(header_pattern, content, re.DOTALL):
-        new_content = re.sub(header_pattern, new_header, content, flags=re.DOTALL)
-    else:
+            end = content.find('\n', start)
+            if end == -1:
+                end = len(content)
+            content_tag = line_to_section[line_num]
+            # Check if line already has the content tag
+            if (content.find(f'[{content_tag}]', start, end) == -1
+                    and content.find(f'[{content_tag}|', start, end) == -1):
+                # Insert content tag after the line number
+                # Pattern: "1. [mix] text" -> "1. [dialogue] [mix] text"
+                match = _NUM_PREFIX_RE.match(content, start, end)
+                if match:
+                    edits.append((start, match.end(), f"{match.group(1)} [{content_tag}] "))
+    
+    # Find the old header to replace
+    header_spans = [m.span() for m in _HEADER_RE.finditer(content)]
+    header_text = new_header
+    if not header_spans:
         # Try alternate pattern for files with different structure
-        header_pattern2 = r'# LINE INDEX\n# Use these.*?(?=\n#\n# ---|\n# --- )'
-        if re.search(header_pattern2, content, re.DOTALL):
-            new_content = re.sub(header_pattern2, f"# LINE INDEX\n{new_header}", content, flags=re.DOTALL)
-        else:
+        header_spans = [m.span() for m in _HEADER_RE2.finditer(content)]
+        header_text = f"# LINE INDEX\n{new_header}"
+        if not header_spans:
             # No existing header found in expected location
-            new_content = content
             print(f"  Warning: Could not find header pattern in {filepath}")
     
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(new_content)
+    # Stream the result into a temp file next to the original, then swap it
+    # in; a crash mid-write can't leave a truncated annotated file behind
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False,
+                                         dir=os.path.dirname(os.path.abspath(filepath))) as tmp:
+            tmp_path = tmp.name
+            tmp.writelines(render(content, header_spans, header_text, edits))
+        shutil.copymode(filepath, tmp_path)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
     
     print(f"  Fixed: {filepath}")
     print(f"    Content types: {dict(content_types)}")
@@ -218,18 +227,28 @@ def main():
         return
     
     # Find all annotated files
+    actors = []
     for actor_dir in sorted(base_dir.iterdir()):
         if not actor_dir.is_dir():
             continue
         
-        print(f"\nProcessing {actor_dir.name}:")
-        
         # Determine if this is an English folder
         is_english = actor_dir.name.startswith('english_')
+        actors.append((actor_dir, is_english, sorted(actor_dir.glob("*_annotated.txt"))))
+    
+    filepaths, flags = [], []
+    for _, is_english, files in actors:
+        filepaths.extend(files)
+        # For non-English files, add inline content type tags
+        flags.extend([not is_english] * len(files))
+    
+    with ProcessPoolExecutor() as ex:
+        results = ex.map(run_captured, repeat(process_file), filepaths, flags, chunksize=4)
         
-        for filepath in sorted(actor_dir.glob("*_annotated.txt")):
-            # For non-English files, add inline content type tags
-            process_file(filepath, add_inline_tags=not is_english)
+        for actor_dir, _, files in actors:
+            print(f"\nProcessing {actor_dir.name}:")
+            for _ in files:
+                print(next(results)[1], end='')
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
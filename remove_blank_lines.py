@@ -7,60 +7,92 @@ Script to clean up annotated text files:
 
 import sys
 import os
-import re
+import shutil
+import tempfile
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from common import run_captured
+
+# Merged lines are written out in batches of this many lines, one write each
+WRITE_BATCH_LINES = 1024
 
 def is_numbered_line(line):
     """Check if a line starts with a number followed by a period (e.g., '507.' or '1.')"""
-    return bool(re.match(r'^\d+\.\s', line.strip()))
+    # Same test as the pattern ^\d+\.\s: the text before the first period
+    # must be all digits (isdecimal is exactly \d) and whitespace must follow
+    s = line.strip()
+    dot = s.find('.')
+    return dot > 0 and s[:dot].isdecimal() and s[dot + 1:dot + 2].isspace()
 
 def clean_and_merge_lines(input_file, output_file=None):
     """Remove blank lines and merge continuation lines with their numbered parent."""
     if output_file is None:
         output_file = input_file
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    original_count = len(lines)
-    
-    # First pass: remove blank lines
-    non_blank_lines = [line.rstrip() for line in lines if line.strip()]
-    
-    # Second pass: merge continuation lines with their parent numbered line
+    original_count = 0
+    non_blank_count = 0
+    merged_count = 0
+    # Parts of the line being merged; joined once when it is complete
+    current_parts = []
+    # Completed lines not yet written
     merged_lines = []
-    current_line = None
-    
-    for line in non_blank_lines:
-        if is_numbered_line(line):
-            # If we have a previous line, save it
-            if current_line is not None:
-                merged_lines.append(current_line)
-            # Start a new numbered line
-            current_line = line
-        else:
-            # This is a continuation line - merge with current
-            if current_line is not None:
-                # Add a space separator and append the continuation
-                current_line = current_line + ' ' + line
-            else:
-                # Edge case: continuation line at the start (shouldn't happen, but handle it)
-                current_line = line
     
-    # Don't forget the last line
-    if current_line is not None:
-        merged_lines.append(current_line)
-    
-    # Write back
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for line in merged_lines:
-            f.write(line + '\n')
+    tmp_path = None
+    try:
+        # Stream the input and write merged lines to a temp file next to the
+        # output in batches; only the current batch is held in memory
+        with open(input_file, 'r', encoding='utf-8') as f, \
+             tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False,
+                                         dir=os.path.dirname(os.path.abspath(output_file))) as out:
+            tmp_path = out.name
+            for line in f:
+                original_count += 1
+                
+                # Remove blank lines
+                if not line.strip():
+                    continue
+                line = line.rstrip()
+                non_blank_count += 1
+                
+                # Merge continuation lines with their parent numbered line
+                if is_numbered_line(line):
+                    # If we have a previous line, save it
+                    if current_parts:
+                        merged_lines.append(' '.join(current_parts))
+                        if len(merged_lines) == WRITE_BATCH_LINES:
+                            out.write('\n'.join(merged_lines) + '\n')
+                            merged_count += len(merged_lines)
+                            merged_lines = []
+                    # Start a new numbered line
+                    current_parts = [line]
+                else:
+                    # This is a continuation line - merge with current (space
+                    # separated). A continuation line at the start (shouldn't
+                    # happen) simply starts the first line.
+                    current_parts.append(line)
+            
+            # Don't forget the last line
+            if current_parts:
+                merged_lines.append(' '.join(current_parts))
+            if merged_lines:
+                out.write('\n'.join(merged_lines) + '\n')
+                merged_count += len(merged_lines)
+        
+        # Write back: swap the temp file in, keeping the existing file's mode
+        shutil.copymode(output_file if os.path.exists(output_file) else input_file, tmp_path)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
     
     print(f"Processed {input_file}")
     print(f"  Original lines: {original_count}")
-    print(f"  After removing blanks: {len(non_blank_lines)}")
-    print(f"  After merging continuations: {len(merged_lines)}")
-    print(f"  Total lines removed/merged: {original_count - len(merged_lines)}")
+    print(f"  After removing blanks: {non_blank_count}")
+    print(f"  After merging continuations: {merged_count}")
+    print(f"  Total lines removed/merged: {original_count - merged_count}")
 
 def process_folder(folder_path):
     """Process all .txt files in a folder."""
@@ -76,10 +108,12 @@ def process_folder(folder_path):
     
     print(f"Found {len(txt_files)} .txt file(s) in '{folder_path}'\n")
     
-    for filename in sorted(txt_files):
-        filepath = os.path.join(folder_path, filename)
-        clean_and_merge_lines(filepath)
-        print()  # Add blank line between files
+    filepaths = [os.path.join(folder_path, filename) for filename in sorted(txt_files)]
+    
+    with ProcessPoolExecutor() as ex:
+        for _, output in ex.map(run_captured, repeat(clean_and_merge_lines), filepaths, chunksize=4):
+            print(output, end='')
+            print()  # Add blank line between files
 
 
 if __name__ == "__main__":
@@ -11,8 +11,24 @@ Applies to: All tag_match files in ALL language folders (hindi, french, korean,
 
 import re
 import os
-import glob
+import fnmatch
+import shutil
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from common import run_captured
+
+# Names of the tag_match files to process in each language folder
+TARGET_FILE_PATTERN = "*tag_match*lines*.txt"
+
+# "Line 33 | Dialogue 12 | [pause]" entry in the English removal log
+_LOG_ENTRY_RE = re.compile(r'Line \d+ \| Dialogue (\d+) \| \[.+\]')
+# "123. ..." dialogue number at the start of every line of a raw file buffer
+_DIAL_LINE_RE = re.compile(rb'^(\d+)\.[^\S\n]', re.MULTILINE)
+# [something] at the very end of a line (possibly with trailing whitespace),
+# plus the whitespace before it so the match can be cut off
+_END_TAG_STRIP_RE = re.compile(r'\s*\[([^\]]+)\]\s*$')
 
 
 def parse_removal_log(log_path):
@@ -41,7 +57,7 @@ def parse_removal_log(log_path):
             # Check for dialogue entry (Line X | Dialogue Y | [tag])
             if is_english_file and line.startswith('Line '):
                 # Parse: "Line 33 | Dialogue 12 | [pause]"
-                match = re.match(r'Line \d+ \| Dialogue (\d+) \| \[.+\]', line)
+                match = _LOG_ENTRY_RE.match(line)
                 if match:
                     dialogue_num = match.group(1)
                     all_dialogue_nums.add(dialogue_num)
@@ -60,12 +76,13 @@ def find_language_folders(actor_lines_path):
     if not os.path.exists(actor_lines_path):
         return language_folders
     
-    for item in os.listdir(actor_lines_path):
-        item_path = os.path.join(actor_lines_path, item)
-        if os.path.isdir(item_path):
+    # scandir entries know whether they are directories, so there is no
+    # separate stat per item
+    with os.scandir(actor_lines_path) as it:
+        for entry in it:
             # Skip English folders
-            if not item.startswith('english_'):
-                language_folders.append(item_path)
+            if entry.is_dir() and not entry.name.startswith('english_'):
+                language_folders.append(entry.path)
     
     return sorted(language_folders)
 
@@ -76,80 +93,139 @@ def find_target_files(language_folder):
     
     Returns list of file paths
     """
-    # Look for files matching pattern *tag_match*_lines*.txt
-    pattern = os.path.join(language_folder, "*tag_match*lines*.txt")
-    all_files = glob.glob(pattern)
+    # Look for files matching pattern *tag_match*_lines*.txt; like glob,
+    # hidden entries are skipped and a missing folder has no matches
+    try:
+        it = os.scandir(language_folder)
+    except OSError:
+        return []
+    with it:
+        all_files = [entry.path for entry in it
+                     if not entry.name.startswith('.')
+                     and fnmatch.fnmatchcase(entry.name, TARGET_FILE_PATTERN)]
     
     return sorted(all_files)
 
 
-def extract_dialogue_number(line):
-    """Extract dialogue number from start of line (e.g., '1.', '2.', '376.')"""
-    match = re.match(r'^(\d+)\.\s', line)
+def split_end_tag(line):
+    """Split a line into (cleaned line, "[tag]") if it ends in a tag, else (line, None).
+    
+    One search yields both the tag and the point where the cleaned line
+    ends (before any whitespace leading up to the tag).
+    """
+    match = _END_TAG_STRIP_RE.search(line)
     if match:
-        return match.group(1)
-    return None
-
-
-def remove_end_tag(line):
-    """Remove tag at end of line and return cleaned line."""
-    cleaned = re.sub(r'\s*\[([^\]]+)\]\s*$', '', line)
-    return cleaned
-
+        return line[:match.start()], f"[{match.group(1)}]"
+    return line, None
 
-def has_end_tag(line):
-    """Check if line has a tag at the end."""
-    return bool(re.search(r'\[([^\]]+)\]\s*$', line))
 
-
-def get_end_tag(line):
-    """Extract the end tag from a line."""
-    match = re.search(r'\[([^\]]+)\]\s*$', line)
-    if match:
-        return f"[{match.group(1)}]"
-    return None
+def target_number_regex(dialogue_nums):
+    """
+    Compile a bytes regex that finds any of the given dialogue numbers (bytes)
+    at the start of a line, for a cheap pre-check of raw file contents.
+    
+    It may match lines that won't be edited, but never misses one that
+    would: a lone \r counts as a line break (as in text mode), and nothing
+    after the period is required.
+    """
+    alternatives = b'|'.join(re.escape(n) for n in sorted(dialogue_nums))
+    return re.compile(rb'(?:^|(?<=\r))(?:' + alternatives + rb')\.', re.MULTILINE)
 
 
-def process_target_file(filepath, dialogue_nums_to_remove):
+def process_target_file(filepath, dialogue_nums_to_remove, number_re=None):
     """
     Process a target file and remove end tags from lines whose dialogue numbers
     are in the removal set.
     
+    dialogue_nums_to_remove holds the numbers as ASCII bytes (b'12'), so they
+    can be tested against the raw file without decoding it. number_re, if
+    given, is target_number_regex(dialogue_nums_to_remove); files it finds no
+    target numbers in are skipped without being scanned.
+    
     Returns list of (file_line_num, dialogue_num, removed_tag) for logging.
     """
     removed = []
-    modified_lines = []
     
+    # Nothing can change without numbers to remove
+    if not dialogue_nums_to_remove:
+        return removed
+    
+    tmp_path = None
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        with open(filepath, 'rb') as f:
+            data = f.read()
         
-        for file_line_num, line in enumerate(lines, 1):
-            line_stripped = line.rstrip('\n')
-            dialogue_num = extract_dialogue_number(line_stripped)
-            
+        if number_re is not None and not number_re.search(data):
+            return removed
+        
+        # Text mode would have turned \r\n and lone \r into \n
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        
+        # Visit only the numbered lines; the bytes between edited lines are
+        # copied over in slices, and only target lines get decoded
+        pieces = []
+        pos = 0
+        file_line_num, line_pos = 1, 0
+        for match in _DIAL_LINE_RE.finditer(data):
             # Check if this dialogue number should have its end tag removed
-            if dialogue_num and dialogue_num in dialogue_nums_to_remove and has_end_tag(line_stripped):
-                removed_tag = get_end_tag(line_stripped)
-                cleaned_line = remove_end_tag(line_stripped)
-                modified_lines.append(cleaned_line + '\n')
-                
-                if removed_tag:
-                    removed.append((file_line_num, dialogue_num, removed_tag))
-            else:
-                modified_lines.append(line)
+            if match.group(1) not in dialogue_nums_to_remove:
+                continue
+            line_start = match.start()
+            line_end = data.find(b'\n', line_start)
+            if line_end == -1:
+                line_end = len(data)
+            cleaned_line, removed_tag = split_end_tag(data[line_start:line_end].decode('utf-8'))
+            
+            if removed_tag:
+                file_line_num += data.count(b'\n', line_pos, line_start)
+                line_pos = line_start
+                pieces.append(data[pos:line_start])
+                # An edited last line always gets a newline
+                pieces.append(cleaned_line.encode('utf-8') if line_end < len(data)
+                              else cleaned_line.encode('utf-8') + b'\n')
+                pos = line_end
+                removed.append((file_line_num, match.group(1).decode('utf-8'), removed_tag))
         
-        # Write back if any changes were made
+        # Write back if any changes were made, via a temp file next to the
+        # target that is swapped in
         if removed:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.writelines(modified_lines)
+            pieces.append(data[pos:])
+            with tempfile.NamedTemporaryFile('wb', delete=False,
+                                             dir=os.path.dirname(os.path.abspath(filepath))) as tmp:
+                tmp_path = tmp.name
+                tmp.writelines(pieces)
+            shutil.copymode(filepath, tmp_path)
+            os.replace(tmp_path, filepath)
         
     except Exception as e:
         print(f"Error processing {filepath}: {e}")
+        # Nothing was written back, so nothing was removed
+        removed = []
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
     
     return removed
 
 
+# Dialogue numbers to remove (as bytes) and their pre-check regex, set once
+# per worker process by _init_worker so they aren't pickled again for every file
+_worker_nums = None
+_worker_number_re = None
+
+
+def _init_worker(dialogue_nums_to_remove):
+    global _worker_nums, _worker_number_re
+    _worker_nums = dialogue_nums_to_remove
+    if dialogue_nums_to_remove:
+        _worker_number_re = target_number_regex(dialogue_nums_to_remove)
+
+
+def _process_in_worker(filepath):
+    """Run process_target_file in a worker; returns (removed, captured output)."""
+    return run_captured(process_target_file, filepath, _worker_nums, _worker_number_re)
+
+
 def main():
     import sys
     
@@ -202,14 +278,20 @@ def main():
     all_removed = []  # (filepath, file_line_num, dialogue_num, removed_tag)
     by_language = defaultdict(int)  # Count removals per language
     
-    for language_folder in language_folders:
+    # Process all files in worker processes up front, then report per
+    # folder in order
+    targets_by_folder = [find_target_files(folder) for folder in language_folders]
+    all_targets = [fp for target_files in targets_by_folder for fp in target_files]
+    nums_bytes = frozenset(n.encode('utf-8') for n in all_dialogue_nums)
+    with ProcessPoolExecutor(initializer=_init_worker, initargs=(nums_bytes,)) as ex:
+        results = ex.map(_process_in_worker, all_targets, chunksize=4)
+    
+    for language_folder, target_files in zip(language_folders, targets_by_folder):
         language_name = os.path.basename(language_folder)
         print(f"\n{'='*60}")
         print(f"Processing: {language_name}")
         print("-" * 60)
         
-        target_files = find_target_files(language_folder)
-        
         if not target_files:
             print(f"  No tag_match files found, skipping")
             continue
@@ -221,7 +303,8 @@ def main():
         language_removed_count = 0
         
         for filepath in target_files:
-            removed = process_target_file(filepath, all_dialogue_nums)
+            removed, output = next(results)
+            print(output, end='')
             
             for file_line_num, dialogue_num, removed_tag in removed:
                 all_removed.append((filepath, file_line_num, dialogue_num, removed_tag))
@@ -254,41 +337,43 @@ def main():
         if len(tag_counts) > 20:
             print(f"  ... and {len(tag_counts) - 20} more unique tags")
     
-    # Write detailed log
+    # Build the detailed log in memory and write it in one call
+    out = [
+        "# Tags removed from ALL translated files based on English removal log\n",
+        f"# Source log: {log_path}\n",
+        f"# Actor lines directory: {actor_lines_path}\n",
+        f"# Total removed: {len(all_removed)}\n",
+        f"# Languages processed: {len(by_language)}\n",
+        "#" + "=" * 59 + "\n\n",
+    ]
+    
+    # Summary by language
+    out.append("## SUMMARY BY LANGUAGE:\n")
+    out.extend(f"  {lang}: {count}\n" for lang, count in sorted(by_language.items(), key=lambda x: -x[1]))
+    out.append("\n")
+    
+    # Summary by tag
+    out.append("## SUMMARY - Tags removed:\n")
+    out.extend(f"  {tag}: {count}\n" for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]))
+    out.append("\n" + "=" * 60 + "\n\n")
+    
+    # Detailed locations
+    out.append("## DETAILED LOCATIONS:\n")
+    out.append("# Format: File path | File line | Dialogue # | Removed tag\n\n")
+    
+    # Group by file
+    by_file_removed = defaultdict(list)
+    for filepath, file_line_num, dialogue_num, tag in all_removed:
+        by_file_removed[filepath].append((file_line_num, dialogue_num, tag))
+    
+    for filepath in sorted(by_file_removed.keys()):
+        out.append(f"### {filepath}\n")
+        out.extend(f"  Line {file_line_num} | Dialogue {dialogue_num} | {tag}\n"
+                   for file_line_num, dialogue_num, tag in sorted(by_file_removed[filepath]))
+        out.append("\n")
+    
     with open(output_log, 'w', encoding='utf-8') as f:
-        f.write("# Tags removed from ALL translated files based on English removal log\n")
-        f.write(f"# Source log: {log_path}\n")
-        f.write(f"# Actor lines directory: {actor_lines_path}\n")
-        f.write(f"# Total removed: {len(all_removed)}\n")
-        f.write(f"# Languages processed: {len(by_language)}\n")
-        f.write("#" + "=" * 59 + "\n\n")
-        
-        # Summary by language
-        f.write("## SUMMARY BY LANGUAGE:\n")
-        for lang, count in sorted(by_language.items(), key=lambda x: -x[1]):
-            f.write(f"  {lang}: {count}\n")
-        f.write("\n")
-        
-        # Summary by tag
-        f.write("## SUMMARY - Tags removed:\n")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
-            f.write(f"  {tag}: {count}\n")
-        f.write("\n" + "=" * 60 + "\n\n")
-        
-        # Detailed locations
-        f.write("## DETAILED LOCATIONS:\n")
-        f.write("# Format: File path | File line | Dialogue # | Removed tag\n\n")
-        
-        # Group by file
-        by_file_removed = defaultdict(list)
-        for filepath, file_line_num, dialogue_num, tag in all_removed:
-            by_file_removed[filepath].append((file_line_num, dialogue_num, tag))
-        
-        for filepath in sorted(by_file_removed.keys()):
-            f.write(f"### {filepath}\n")
-            for file_line_num, dialogue_num, tag in sorted(by_file_removed[filepath]):
-                f.write(f"  Line {file_line_num} | Dialogue {dialogue_num} | {tag}\n")
-            f.write("\n")
+        f.write("".join(out))
     
     print(f"\nDetailed log written to: {output_log}")
 
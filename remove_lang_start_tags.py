@@ -1,6 +1,16 @@
 import os
 import re
+import mmap
 import argparse
+from collections import defaultdict
+
+# Log entry: "Dialogue 309 (file line 323) in /path/to/file.txt" (bytes, for
+# scanning the memory-mapped log)
+_LOG_ENTRY_RE = re.compile(rb'Dialogue (\d+) \(file line \d+\) in ([^\r\n]+)')
+# "309. [anything] " start tag on any line of a raw file buffer -> dialogue
+# number and tag body. The match ends where the text after the tag starts,
+# taking the line's own newline if nothing follows the tag.
+_START_TAG_LINE_RE = re.compile(rb'^(\d+)\.[^\S\n]*\[([^\]\n]+)\][^\S\n]*\n?', re.MULTILINE)
 
 # Parse arguments
 parser = argparse.ArgumentParser(description='Remove tags from tag_match files based on removal log')
@@ -15,23 +25,54 @@ if DRY_RUN:
 # Parse the log file to get dialogue numbers and their source files
 log_path = "/workspace/multilingual_fun_lines/start_removed.txt"
 
-# Store: {filepath: [dialogue_nums]}
-removals = {}
-
-with open(log_path, 'r', encoding='utf-8') as f:
-    content = f.read()
-
-# Parse entries like: "Dialogue 309 (file line 323) in /path/to/file.txt"
-pattern = r'Dialogue (\d+) \(file line \d+\) in ([^\n]+)'
-for match in re.finditer(pattern, content):
-    dialogue_num = match.group(1)
-    filepath = match.group(2).strip()
-    
-    if filepath not in removals:
-        removals[filepath] = []
-    removals[filepath].append(dialogue_num)
-
-print(f"Found {sum(len(v) for v in removals.values())} dialogue removals across {len(removals)} files")
+# Store: {filepath: {dialogue_nums}}, ready for lookups while editing
+removals = defaultdict(set)
+total_removals = 0
+
+# Scan the log through a read-only mapping rather than reading a copy of it
+# into memory. An empty log can't be mapped, and has no entries anyway.
+with open(log_path, 'rb') as f:
+    if os.fstat(f.fileno()).st_size:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            # Parse entries like: "Dialogue 309 (file line 323) in /path/to/file.txt"
+            for match in _LOG_ENTRY_RE.finditer(content):
+                dialogue_num = match.group(1).decode('ascii')
+                filepath = match.group(2).strip().decode('utf-8')
+                
+                removals[filepath].add(dialogue_num)
+                total_removals += 1
+
+print(f"Found {total_removals} dialogue removals across {len(removals)} files")
+
+# Per-directory lookup of tag_match files, built the first time a directory
+# is needed: {directory: {(is_numbered, base): tag_match filename}}
+_tag_match_index = {}
+
+def index_tag_match_files(directory):
+    """Map (is_numbered, base name with _tag_match removed) to each tag_match file in a directory"""
+    index = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            f = entry.name
+            # Skip annotated files
+            if '_annotated.txt' in f:
+                continue
+            
+            if '_tag_match_' not in f:
+                continue
+            
+            # Numbered and non-numbered files are looked up separately
+            # new_order_tag_match_fr_f_lines_numbered.txt -> new_order_fr_f (with _tag_match removed)
+            if f.endswith('_lines_numbered.txt'):
+                key = (True, f[:-len('_lines_numbered.txt')].replace('_tag_match', ''))
+            elif f.endswith('_lines.txt'):
+                key = (False, f[:-len('_lines.txt')].replace('_tag_match', ''))
+            else:
+                continue
+            
+            # First match in directory order wins, as with a linear search
+            index.setdefault(key, f)
+    return index
 
 def get_tag_match_path(source_path):
     """Find the corresponding tag_match file"""
@@ -61,43 +102,17 @@ def get_tag_match_path(source_path):
         # new_order_fr_f_lines.txt
         base = filename[:-len('_lines.txt')]
     
-    # Search for matching tag_match file
-    for f in os.listdir(directory):
-        # Skip annotated files
-        if '_annotated.txt' in f:
-            continue
-            
-        if '_tag_match_' not in f:
-            continue
-        
-        # Match the numbered/non-numbered suffix
-        if is_numbered and not f.endswith('_lines_numbered.txt'):
-            continue
-        if not is_numbered and not f.endswith('_lines.txt'):
-            continue
-        if not is_numbered and f.endswith('_lines_numbered.txt'):
-            continue
-        
-        # Check if this is the right content match
-        # new_order_tag_match_fr_f_lines_numbered.txt -> new_order_fr_f (with _tag_match removed)
-        if is_numbered:
-            tag_match_base = f[:-len('_lines_numbered.txt')]
-        else:
-            tag_match_base = f[:-len('_lines.txt')]
-        
-        # Remove _tag_match to compare
-        tag_match_base_clean = tag_match_base.replace('_tag_match', '')
-        
-        if tag_match_base_clean == base:
-            return os.path.join(directory, f)
+    # Look up the matching tag_match file, listing the directory only once
+    index = _tag_match_index.get(directory)
+    if index is None:
+        index = _tag_match_index[directory] = index_tag_match_files(directory)
+    
+    f = index.get((is_numbered, base))
+    if f is not None:
+        return os.path.join(directory, f)
     
     return None
 
-def remove_start_tag_from_line(line):
-    """Remove any tag at the start of a numbered line: '309. [anything] Text' -> '309. Text'"""
-    pattern = r'^(\d+)\.\s*\[[^\]]+\]\s*'
-    return re.sub(pattern, r'\1. ', line)
-
 # Process each tag_match file
 modified_files = 0
 total_tags_removed = 0
@@ -106,7 +121,7 @@ skipped_english = 0
 skipped_tag_match = 0
 not_found = []
 
-for source_path, dialogue_nums in removals.items():
+for source_path, target_nums in removals.items():
     # Skip English files
     if '/english_' in source_path:
         skipped_english += 1
@@ -127,42 +142,47 @@ for source_path, dialogue_nums in removals.items():
         not_found.append(f"{source_path} -> {tag_match_path}")
         continue
     
-    # Read the tag_match file
-    with open(tag_match_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    
-    # Convert dialogue nums to set for fast lookup
-    target_nums = set(dialogue_nums)
-    
-    modified = False
-    new_lines = []
-    
-    for line in lines:
-        original_line = line
-        # Check if this line starts with a target dialogue number
-        line_match = re.match(r'^(\d+)\.', line)
-        if line_match and line_match.group(1) in target_nums:
-            new_line = remove_start_tag_from_line(line)
-            if new_line != line:
-                # Extract the removed tag for logging
-                tag_match = re.match(r'^\d+\.\s*\[([^\]]+)\]', line)
-                removed_tag = tag_match.group(1) if tag_match else "unknown"
-                removal_log.append({
-                    'dialogue_num': line_match.group(1),
-                    'filepath': tag_match_path,
-                    'tag': removed_tag,
-                    'original': line.strip(),
-                    'new': new_line.strip()
-                })
-                total_tags_removed += 1
-                modified = True
-                line = new_line
-        new_lines.append(line)
-    
+    # Read the tag_match file as raw bytes; only edited lines get decoded
+    with open(tag_match_path, 'rb') as f:
+        data = f.read()
+    # Text mode would have turned \r\n and lone \r into \n
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    
+    target = {num.encode('utf-8') for num in target_nums}
+    
+    # Visit only lines that start with a number and a start tag. Each edit
+    # swaps the matched span for "309. "; the bytes in between are kept as
+    # slices, so files without a match are never copied.
+    pieces = []
+    pos = 0
+    for line_match in _START_TAG_LINE_RE.finditer(data):
+        dialogue_num = line_match.group(1)
+        if dialogue_num not in target:
+            continue
+        start, end = line_match.span()
+        line_end = data.find(b'\n', start)
+        if line_end == -1:
+            line_end = len(data)
+        new_line = dialogue_num + b'. ' + data[end:line_end]
+        removal_log.append({
+            'dialogue_num': dialogue_num.decode('utf-8'),
+            'filepath': tag_match_path,
+            'tag': line_match.group(2).decode('utf-8'),
+            'original': data[start:line_end].decode('utf-8').strip(),
+            'new': new_line.decode('utf-8').strip()
+        })
+        total_tags_removed += 1
+        pieces.append(data[pos:start])
+        pieces.append(dialogue_num + b'. ')
+        pos = end
+    
+    modified = bool(pieces)
     if modified:
         if not DRY_RUN:
-            with open(tag_match_path, 'w', encoding='utf-8') as f:
-                f.writelines(new_lines)
+            pieces.append(data[pos:])
+            with open(tag_match_path, 'wb') as f:
+                f.writelines(pieces)
         modified_files += 1
         prefix = "[DRY RUN] Would modify" if DRY_RUN else "Modified"
         print(f"{prefix}: {tag_match_path}")
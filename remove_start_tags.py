@@ -1,5 +1,8 @@
 import os
 import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 # Tags that produce no audio or would be removed as silence
 SILENT_TAGS = [
@@ -26,106 +29,170 @@ SILENT_TAGS = [
     "thoughtful pause",
 ]
 
-removed_log = []
+# Every silent tag as one alternation, so a line is matched against all
+# of them at once
+_TAG_ALT = '|'.join(re.escape(tag) for tag in SILENT_TAGS)
+# The patterns below only need ASCII \d and \s: the tags, numbers and the
+# spacing around them are plain ASCII markers around the text.
+# After line number: "240. [tag] " -> "240. "
+_AFTER_NUMBER_RE = re.compile(rf'^(\d+)\.\s*\[(?P<tag>{_TAG_ALT})\]\s*', re.ASCII)
+# At very start of line: "[tag] Text" -> "Text"
+_AT_START_RE = re.compile(rf'^\[(?P<tag>{_TAG_ALT})\]\s*', re.ASCII)
+# After character label: "Character 1: [tag] Text" -> "Character 1: Text"
+_AFTER_LABEL_RE = re.compile(rf'^([^:\n]+:\s*)\[(?P<tag>{_TAG_ALT})\]\s*', re.ASCII)
+# Any of the three, in one match: a line start this doesn't match has no
+# silent tag to remove
+_ANY_START_TAG_RE = re.compile(rf'^(?:\d+\.\s*|[^:\n]+:\s*)?\[(?:{_TAG_ALT})\]', re.ASCII)
+# Position of each tag in SILENT_TAGS
+_TAG_ORDER = {tag: i for i, tag in enumerate(SILENT_TAGS)}
 
-def remove_silent_tags_at_start(text, filepath):
-    """Remove silent tags only at the start of lines/dialogue"""
-    lines = text.split('\n')
-    new_lines = []
+def _walk(root):
+    """Yield the .txt files under root in the order os.walk lists them.
     
-    for file_line_num, line in enumerate(lines, 1):
-        original_line = line
-        
-        for tag in SILENT_TAGS:
-            # After line number: "240. [tag] " -> "240. "
-            pattern1 = rf'^(\d+)\.\s*\[{re.escape(tag)}\]\s*'
-            match1 = re.match(pattern1, line)
-            if match1:
-                dialogue_num = match1.group(1)
-                line = re.sub(pattern1, r'\1. ', line)
-                removed_log.append({
-                    'dialogue_num': dialogue_num,
-                    'file_line': file_line_num,
-                    'filepath': filepath,
-                    'tag': tag,
-                    'original': original_line.strip()
-                })
-                continue
-            
-            # At very start of line: "[tag] Text" -> "Text"
-            pattern2 = rf'^\[{re.escape(tag)}\]\s*'
-            match2 = re.match(pattern2, line)
-            if match2:
-                line = re.sub(pattern2, '', line)
-                removed_log.append({
-                    'dialogue_num': None,
-                    'file_line': file_line_num,
-                    'filepath': filepath,
-                    'tag': tag,
-                    'original': original_line.strip()
-                })
-                continue
-            
-            # After character label: "Character 1: [tag] Text" -> "Character 1: Text"
-            pattern3 = rf'^([^:\n]+:\s*)\[{re.escape(tag)}\]\s*'
-            match3 = re.match(pattern3, line)
-            if match3:
-                line = re.sub(pattern3, r'\1', line)
-                removed_log.append({
-                    'dialogue_num': None,
-                    'file_line': file_line_num,
-                    'filepath': filepath,
-                    'tag': tag,
-                    'original': original_line.strip()
-                })
-                continue
+    A directory's files come before those in its subdirectories, symlinked
+    directories aren't followed, and unreadable directories are skipped.
+    """
+    try:
+        it = os.scandir(root)
+    except OSError:
+        return
+    subdirs = []
+    with it:
+        for e in it:
+            try:
+                is_dir = e.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not e.is_symlink():
+                    subdirs.append(e.path)
+            elif e.name.endswith('.txt'):
+                yield e.path
+    for subdir in subdirs:
+        yield from _walk(subdir)
+
+def remove_silent_tags_from_line(line, file_line_num, filepath, removed_log):
+    """Remove silent tags at the start of one line (without its newline), logging each to removed_log"""
+    # Cheap reject for the common case: every pattern needs a '[', and one
+    # combined match rules out the remaining lines without a silent tag
+    if '[' not in line or not _ANY_START_TAG_RE.match(line):
+        return line
+    
+    original_line = line
+    
+    # Tags are tried in SILENT_TAGS order and each is removed at most
+    # once, so after a removal only tags later in the list still count.
+    # Each pattern can match just one tag on a line; the next removal is
+    # the candidate that comes first in the list.
+    next_tag = 0
+    while True:
+        best = None
+        for pattern in (_AFTER_NUMBER_RE, _AT_START_RE, _AFTER_LABEL_RE):
+            match = pattern.match(line)
+            if match:
+                order = _TAG_ORDER[match.group('tag')]
+                if order >= next_tag and (best is None or order < best[0]):
+                    best = (order, pattern, match)
+        if best is None:
+            break
+        order, pattern, match = best
+        next_tag = order + 1
         
-        new_lines.append(line)
+        dialogue_num = None
+        if pattern is _AFTER_NUMBER_RE:
+            dialogue_num = match.group(1)
+            line = f"{dialogue_num}. " + line[match.end():]
+        elif pattern is _AT_START_RE:
+            line = line[match.end():]
+        else:
+            line = match.group(1) + line[match.end():]
+        removed_log.append({
+            'dialogue_num': dialogue_num,
+            'file_line': file_line_num,
+            'filepath': filepath,
+            'tag': match.group('tag'),
+            'original': original_line.strip()
+        })
     
-    return '\n'.join(new_lines)
+    return line
 
 def process_file(filepath):
-    """Process a single file and remove silent tags at line starts"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
+    """Process a single file and remove silent tags at line starts.
     
-    original = content
-    cleaned = remove_silent_tags_at_start(content, filepath)
+    Returns the log entries for the removed tags; the file was modified if
+    there are any.
+    """
+    removed_log = []
     
-    if original != cleaned:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(cleaned)
-        return True
-    return False
-
-# Find all relevant .txt files
-base_dir = "/workspace/multilingual_fun_lines/actor_lines"
-modified_count = 0
-total_count = 0
+    # First pass: find the lines to edit. Files without any, the common
+    # case once they are clean, are only read.
+    edits = {}
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for file_line_num, line in enumerate(f, 1):
+            text = line.rstrip('\n')
+            cleaned = remove_silent_tags_from_line(text, file_line_num, filepath, removed_log)
+            if cleaned != text:
+                edits[file_line_num] = cleaned + line[len(text):]
+    
+    # Write back if any changes were made: stream the file again into a
+    # temp file next to it, with the edited lines swapped in, and replace
+    # the file with it
+    if edits:
+        tmp_path = None
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f, \
+                 tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False,
+                                             dir=os.path.dirname(os.path.abspath(filepath))) as out:
+                tmp_path = out.name
+                for file_line_num, line in enumerate(f, 1):
+                    out.write(edits.get(file_line_num, line))
+            shutil.copymode(filepath, tmp_path)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    return removed_log
 
-for root, dirs, files in os.walk(base_dir):
-    for filename in files:
-        if filename.endswith('.txt'):
-            filepath = os.path.join(root, filename)
-            total_count += 1
-            if process_file(filepath):
+def main():
+    # Find all relevant .txt files
+    base_dir = "/workspace/multilingual_fun_lines/actor_lines"
+    filepaths = list(_walk(base_dir))
+    
+    modified_count = 0
+    removed_log = []
+    
+    # Collect the workers' log entries in file order
+    with ProcessPoolExecutor() as ex:
+        for filepath, removed in zip(filepaths, ex.map(process_file, filepaths, chunksize=4)):
+            if removed:
                 modified_count += 1
                 print(f"Modified: {filepath}")
-
-# Save removed log
-log_path = "/workspace/multilingual_fun_lines/start_removed.txt"
-with open(log_path, 'w', encoding='utf-8') as f:
-    f.write(f"# Removed {len(removed_log)} silent tags from start of lines\n")
-    f.write(f"# Tags removed: {SILENT_TAGS}\n\n")
+                removed_log.extend(removed)
+    
+    # Save removed log
+    log_path = "/workspace/multilingual_fun_lines/start_removed.txt"
+    # Build the log in memory and write it in one call
+    out = [
+        f"# Removed {len(removed_log)} silent tags from start of lines\n",
+        f"# Tags removed: {SILENT_TAGS}\n\n",
+    ]
     
     for entry in removed_log:
         if entry['dialogue_num']:
-            f.write(f"Dialogue {entry['dialogue_num']} (file line {entry['file_line']}) in {entry['filepath']}\n")
+            location = f"Dialogue {entry['dialogue_num']} (file line {entry['file_line']})"
         else:
-            f.write(f"File line {entry['file_line']} in {entry['filepath']}\n")
-        f.write(f"  Tag: [{entry['tag']}]\n")
-        f.write(f"  Original: {entry['original']}\n\n")
+            location = f"File line {entry['file_line']}"
+        out.append(f"{location} in {entry['filepath']}\n"
+                   f"  Tag: [{entry['tag']}]\n"
+                   f"  Original: {entry['original']}\n\n")
+    
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write("".join(out))
+    
+    print(f"\nDone! Modified {modified_count}/{len(filepaths)} files")
+    print(f"Removed {len(removed_log)} tags total")
+    print(f"Log saved to: {log_path}")
 
-print(f"\nDone! Modified {modified_count}/{total_count} files")
-print(f"Removed {len(removed_log)} tags total")
-print(f"Log saved to: {log_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,35 @@ Applies to: Specified target files (e.g., Hindi translations)
 
 import re
 import os
+import mmap
+import shutil
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
+
+from common import run_captured
+
+# Line of the removal log, matched across the whole raw log at once: a
+# "### /path/to/file.txt" file header (path as group 1) or a
+# "Line 33 | Dialogue 12 | [pause]" entry (dialogue number as group 2).
+# Whitespace around the line is allowed, since lines used to be stripped.
+# Lines end at \n, \r\n or a lone \r, as they did when read in text mode.
+_LOG_LINE_RE = re.compile(
+    rb'(?:^|(?<=\r))[^\S\r\n]*(?:'
+    rb'### ([^\r\n]*?\S)[^\S\r\n]*(?=[\r\n]|\Z)'
+    rb'|Line \d+ \| Dialogue (\d+) \| \[[^\r\n]+\]'
+    rb')',
+    re.MULTILINE,
+)
+# [something] at the very end of a line (possibly with trailing whitespace),
+# along with any whitespace leading up to it. ASCII \s is enough for the
+# spacing around tags.
+_END_TAG_STRIP_RE = re.compile(r'\s*\[([^\]]+)\]\s*$', re.ASCII)
+
+# What \s matches under re.ASCII
+_ASCII_SPACE = frozenset(' \t\n\r\x0b\x0c')
 
 def parse_removal_log(log_path):
     """
@@ -22,44 +50,47 @@ def parse_removal_log(log_path):
     
     current_file = None
     
-    with open(log_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            
-            # Check for file header (### /path/to/file.txt)
-            if line.startswith('### '):
-                current_file = line[4:]
-                continue
-            
-            # Check for dialogue entry (Line X | Dialogue Y | [tag])
-            if current_file and line.startswith('Line '):
-                # Parse: "Line 33 | Dialogue 12 | [pause]"
-                match = re.match(r'Line \d+ \| Dialogue (\d+) \| \[.+\]', line)
-                if match:
-                    dialogue_num = match.group(1)
-                    by_file[current_file].add(dialogue_num)
-                    all_dialogue_nums.add(dialogue_num)
+    # Scan the log through a read-only mapping rather than reading it line
+    # by line. An empty log can't be mapped, and has no entries anyway.
+    with open(log_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                for match in _LOG_LINE_RE.finditer(content):
+                    header, dialogue_num = match.groups()
+                    
+                    # File header (### /path/to/file.txt)
+                    if header is not None:
+                        current_file = header.decode('utf-8')
+                    
+                    # Dialogue entry (Line X | Dialogue Y | [tag])
+                    elif current_file:
+                        dialogue_num = dialogue_num.decode('ascii')
+                        by_file[current_file].add(dialogue_num)
+                        all_dialogue_nums.add(dialogue_num)
     
     return by_file, all_dialogue_nums
 
 
 def extract_dialogue_number(line):
     """Extract dialogue number from start of line (e.g., '1.', '2.', '376.')"""
-    match = re.match(r'^(\d+)\.\s', line)
-    if match:
-        return match.group(1)
+    # Same test as the pattern ^(\d+)\.\s under re.ASCII: the text before the
+    # first period must be all ASCII digits and ASCII whitespace must follow
+    dot = line.find('.')
+    num = line[:dot]
+    if dot > 0 and num.isascii() and num.isdigit() and line[dot + 1:dot + 2] in _ASCII_SPACE:
+        return line[:dot]
     return None
 
 
-def remove_end_tag(line):
-    """Remove tag at end of line and return cleaned line."""
-    cleaned = re.sub(r'\s*\[([^\]]+)\]\s*$', '', line)
-    return cleaned
-
-
-def has_end_tag(line):
-    """Check if line has a tag at the end."""
-    return bool(re.search(r'\[([^\]]+)\]\s*$', line))
+def split_end_tag(line):
+    """Split a line into (cleaned line, "[tag]") if it ends in a tag, else (line, None)."""
+    # Cheap reject for the common case of an untagged line
+    if not line.rstrip().endswith(']'):
+        return line, None
+    match = _END_TAG_STRIP_RE.search(line)
+    if match:
+        return line[:match.start()], f"[{match.group(1)}]"
+    return line, None
 
 
 def process_target_file(filepath, dialogue_nums_to_remove):
@@ -70,41 +101,62 @@ def process_target_file(filepath, dialogue_nums_to_remove):
     Returns list of (file_line_num, dialogue_num, removed_tag) for logging.
     """
     removed = []
-    modified_lines = []
+    tmp_path = None
     
     try:
+        # First pass: find the lines to edit. Files without any, the common
+        # case once they are clean, are only read.
+        edits = {}
         with open(filepath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        for file_line_num, line in enumerate(lines, 1):
-            line_stripped = line.rstrip('\n')
-            dialogue_num = extract_dialogue_number(line_stripped)
-            
-            # Check if this dialogue number should have its end tag removed
-            if dialogue_num and dialogue_num in dialogue_nums_to_remove and has_end_tag(line_stripped):
-                # Extract the tag before removing it (for logging)
-                tag_match = re.search(r'\[([^\]]+)\]\s*$', line_stripped)
-                removed_tag = f"[{tag_match.group(1)}]" if tag_match else None
+            for file_line_num, line in enumerate(f, 1):
+                line_stripped = line.rstrip('\n')
+                dialogue_num = extract_dialogue_number(line_stripped)
                 
-                cleaned_line = remove_end_tag(line_stripped)
-                modified_lines.append(cleaned_line + '\n')
-                
-                if removed_tag:
-                    removed.append((file_line_num, dialogue_num, removed_tag))
-            else:
-                modified_lines.append(line)
+                # Check if this dialogue number should have its end tag removed
+                if dialogue_num and dialogue_num in dialogue_nums_to_remove:
+                    cleaned_line, removed_tag = split_end_tag(line_stripped)
+                    if removed_tag:
+                        edits[file_line_num] = cleaned_line + '\n'
+                        removed.append((file_line_num, dialogue_num, removed_tag))
         
-        # Write back if any changes were made
+        # Write back if any changes were made: stream the file again into a
+        # temp file next to it, with the edited lines swapped in, and
+        # replace the file with it
         if removed:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.writelines(modified_lines)
+            with open(filepath, 'r', encoding='utf-8') as f, \
+                 tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False,
+                                             dir=os.path.dirname(os.path.abspath(filepath))) as out:
+                tmp_path = out.name
+                for file_line_num, line in enumerate(f, 1):
+                    out.write(edits.get(file_line_num, line))
+            shutil.copymode(filepath, tmp_path)
+            os.replace(tmp_path, filepath)
         
     except Exception as e:
         print(f"Error processing {filepath}: {e}")
+        # Nothing was written back, so nothing was removed
+        removed = []
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
     
     return removed
 
 
+# Dialogue numbers to remove, set once per worker process by _init_worker so
+# they aren't pickled again for every file
+_worker_nums = None
+
+
+def _init_worker(dialogue_nums_to_remove):
+    global _worker_nums
+    _worker_nums = dialogue_nums_to_remove
+
+
+def _process_in_worker(filepath):
+    """Run process_target_file in a worker; returns (removed, captured output)."""
+    return run_captured(process_target_file, filepath, _worker_nums)
+
+
 def main():
     import sys
     
@@ -145,14 +197,39 @@ def main():
     # Process each target file
     all_removed = []  # (filepath, file_line_num, dialogue_num, removed_tag)
     
+    # Process the existing files in worker processes up front, then report
+    # in order. A file named more than once is visited again for each later
+    # mention, one round per repeat, so no two workers edit it at once.
+    keys = []  # (real path, visit) per target, None if it doesn't exist
+    visits = defaultdict(int)
+    rounds = []  # rounds[visit]: real paths visited for the (visit+1)th time
     for filepath in target_files:
+        if not os.path.exists(filepath):
+            keys.append(None)
+            continue
+        path = os.path.realpath(filepath)
+        visit = visits[path]
+        visits[path] += 1
+        if visit == len(rounds):
+            rounds.append([])
+        rounds[visit].append(path)
+        keys.append((path, visit))
+    
+    results = {}
+    with ProcessPoolExecutor(initializer=_init_worker, initargs=(all_dialogue_nums,)) as ex:
+        for visit, paths in enumerate(rounds):
+            results.update(((path, visit), result)
+                           for path, result in zip(paths, ex.map(_process_in_worker, paths)))
+    
+    for filepath, key in zip(target_files, keys):
         print(f"\nProcessing: {filepath}")
         
-        if not os.path.exists(filepath):
+        if key is None:
             print(f"  WARNING: File not found, skipping")
             continue
         
-        removed = process_target_file(filepath, all_dialogue_nums)
+        removed, output = results[key]
+        print(output, end='')
         
         for file_line_num, dialogue_num, removed_tag in removed:
             all_removed.append((filepath, file_line_num, dialogue_num, removed_tag))
@@ -173,33 +250,32 @@ def main():
         for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
             print(f"  {tag}: {count}")
     
-    # Write detailed log
+    # Build the detailed log in memory and write it in one call
+    out = [
+        "# Tags removed from translated files based on English removal log\n",
+        f"# Source log: {log_path}\n",
+        f"# Total removed: {len(all_removed)}\n",
+        "#" + "=" * 59 + "\n\n",
+    ]
+    
+    # Summary
+    out.append("## SUMMARY - Tags removed:\n")
+    out.extend(f"  {tag}: {count}\n" for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]))
+    out.append("\n" + "=" * 60 + "\n\n")
+    
+    # Detailed locations
+    out.append("## DETAILED LOCATIONS:\n")
+    out.append("# Format: File path | File line | Dialogue # | Removed tag\n\n")
+    
+    # Group by file: one sort orders the removals by file, then line
+    for filepath, entries in groupby(sorted(all_removed), key=itemgetter(0)):
+        out.append(f"### {filepath}\n")
+        out.extend(f"  Line {file_line_num} | Dialogue {dialogue_num} | {tag}\n"
+                   for _, file_line_num, dialogue_num, tag in entries)
+        out.append("\n")
+    
     with open(output_log, 'w', encoding='utf-8') as f:
-        f.write("# Tags removed from translated files based on English removal log\n")
-        f.write(f"# Source log: {log_path}\n")
-        f.write(f"# Total removed: {len(all_removed)}\n")
-        f.write("#" + "=" * 59 + "\n\n")
-        
-        # Summary
-        f.write("## SUMMARY - Tags removed:\n")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
-            f.write(f"  {tag}: {count}\n")
-        f.write("\n" + "=" * 60 + "\n\n")
-        
-        # Detailed locations
-        f.write("## DETAILED LOCATIONS:\n")
-        f.write("# Format: File path | File line | Dialogue # | Removed tag\n\n")
-        
-        # Group by file
-        by_file_removed = defaultdict(list)
-        for filepath, file_line_num, dialogue_num, tag in all_removed:
-            by_file_removed[filepath].append((file_line_num, dialogue_num, tag))
-        
-        for filepath in sorted(by_file_removed.keys()):
-            f.write(f"### {filepath}\n")
-            for file_line_num, dialogue_num, tag in sorted(by_file_removed[filepath]):
-                f.write(f"  Line {file_line_num} | Dialogue {dialogue_num} | {tag}\n")
-            f.write("\n")
+        f.write("".join(out))
     
     print(f"\nDetailed log written to: {output_log}")
 
@@ -9,9 +9,13 @@ Searches files matching:
 """
 
 import re
-import glob
 import os
-from collections import defaultdict
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from common import run_captured, walk_files
 
 # Allowed tags list
 ALLOWED_TAGS = {
@@ -43,49 +47,46 @@ ALLOWED_TAGS = {
     "[breaking slightly]"
 }
 
-# Lowercase version for case-insensitive matching
-ALLOWED_TAGS_LOWER = {tag.lower() for tag in ALLOWED_TAGS}
+# Lowercased tag bodies (brackets stripped) for case-insensitive matching
+# directly against the regex capture group
+_ALLOWED = frozenset(tag[1:-1].lower() for tag in ALLOWED_TAGS)
 
+# [something] at the very end of a line (possibly with trailing whitespace),
+# along with any whitespace leading up to it. ASCII \s is enough for the
+# spacing around tags.
+_END_TAG_STRIP_RE = re.compile(r'\s*\[([^\]]+)\]\s*$', re.ASCII)
+# "123. ..." -> dialogue number
+_DIAL_NUM_RE = re.compile(r'^(\d+)\.\s', re.ASCII)
 
-def find_target_files(base_path="/workspace/multilingual_fun_lines/actor_lines"):
-    """Find all target files matching the pattern (_lines.txt but not _lines_numbered.txt and not tag_match)."""
-    target_files = []
-    
-    # Search for all *_lines.txt files recursively
-    pattern = os.path.join(base_path, "**", "*_lines.txt")
-    all_files = glob.glob(pattern, recursive=True)
-    
-    # Filter out files with "tag_match" in the name or "_lines_numbered" in the name
-    for f in all_files:
-        basename = os.path.basename(f)
-        if "tag_match" not in basename and "_lines_numbered" not in basename:
-            target_files.append(f)
-    
-    return sorted(target_files)
 
+def _is_target(name):
+    """Whether a file name is a target: *_lines.txt, not tag_match, not _lines_numbered."""
+    return name.endswith('_lines.txt') and 'tag_match' not in name and '_lines_numbered' not in name
 
-def extract_end_tag(line):
-    """Extract tag at end of line if present."""
-    # Match [something] at the very end of the line (possibly with trailing whitespace)
-    match = re.search(r'\[([^\]]+)\]\s*$', line)
-    if match:
-        return f"[{match.group(1)}]"
-    return None
+
+def find_target_files(base_path="/workspace/multilingual_fun_lines/actor_lines"):
+    """Find all target files matching the pattern (_lines.txt but not _lines_numbered.txt and not tag_match)."""
+    return sorted(walk_files(base_path, _is_target))
 
 
 def extract_dialogue_number(line):
     """Extract dialogue number from start of line (e.g., '1.', '2.', '376.')"""
-    match = re.match(r'^(\d+)\.\s', line)
+    match = _DIAL_NUM_RE.match(line)
     if match:
         return match.group(1)
     return None
 
 
-def remove_end_tag(line):
-    """Remove tag at end of line and return cleaned line."""
-    # Remove [something] at the very end of the line (and any trailing whitespace before it)
-    cleaned = re.sub(r'\s*\[([^\]]+)\]\s*$', '', line)
-    return cleaned
+def split_unlisted_end_tag(line):
+    """Split a line into (cleaned line, "[tag]") if it ends in a tag that is not allowed, else (line, None)."""
+    # Cheap reject for the common case of an untagged line
+    if not line.rstrip().endswith(']'):
+        return line, None
+    match = _END_TAG_STRIP_RE.search(line)
+    # Check if tag is NOT in allowed list (case-insensitive)
+    if match and match.group(1).lower() not in _ALLOWED:
+        return line[:match.start()], f"[{match.group(1)}]"
+    return line, None
 
 
 def process_file(filepath):
@@ -96,33 +97,42 @@ def process_file(filepath):
     - Return list of (file_line_num, dialogue_num, tag) for removed tags
     """
     removed = []
-    modified_lines = []
+    tmp_path = None
     
     try:
+        # First pass: find the lines to edit. Files without any, the common
+        # case once they are clean, are only read.
+        edits = {}
         with open(filepath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        for file_line_num, line in enumerate(lines, 1):
-            line_stripped = line.rstrip('\n')
-            tag = extract_end_tag(line_stripped)
-            
-            if tag and tag.lower() not in ALLOWED_TAGS_LOWER:
-                # Tag is NOT allowed - remove it
-                dialogue_num = extract_dialogue_number(line_stripped)
-                cleaned_line = remove_end_tag(line_stripped)
-                modified_lines.append(cleaned_line + '\n')
-                removed.append((file_line_num, dialogue_num, tag))
-            else:
-                # Keep line as-is
-                modified_lines.append(line)
+            for file_line_num, line in enumerate(f, 1):
+                line_stripped = line.rstrip('\n')
+                cleaned_line, tag = split_unlisted_end_tag(line_stripped)
+                
+                if tag:
+                    # Tag is NOT allowed - remove it
+                    dialogue_num = extract_dialogue_number(line_stripped)
+                    edits[file_line_num] = cleaned_line + '\n'
+                    removed.append((file_line_num, dialogue_num, tag))
         
-        # Write back if any changes were made
+        # Write back if any changes were made: stream the file again into a
+        # temp file next to it, with the edited lines swapped in, and
+        # replace the file with it
         if removed:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.writelines(modified_lines)
+            with open(filepath, 'r', encoding='utf-8') as f, \
+                 tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False,
+                                             dir=os.path.dirname(os.path.abspath(filepath))) as out:
+                tmp_path = out.name
+                for file_line_num, line in enumerate(f, 1):
+                    out.write(edits.get(file_line_num, line))
+            shutil.copymode(filepath, tmp_path)
+            os.replace(tmp_path, filepath)
         
     except Exception as e:
         print(f"Error processing {filepath}: {e}")
+        # Nothing was written back, so nothing was removed
+        removed = []
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
     
     return removed
 
@@ -160,8 +170,11 @@ def main():
     all_removed = []  # List of (filepath, file_line_num, dialogue_num, tag)
     tag_counts = {}   # Count of each unique removed tag
     
-    for filepath in target_files:
-        removed = process_file(filepath)
+    with ProcessPoolExecutor() as ex:
+        results = list(ex.map(run_captured, repeat(process_file), target_files, chunksize=4))
+    
+    for filepath, (removed, output) in zip(target_files, results):
+        print(output, end='')
         for file_line_num, dialogue_num, tag in removed:
             all_removed.append((filepath, file_line_num, dialogue_num, tag))
             tag_counts[tag] = tag_counts.get(tag, 0) + 1
@@ -177,34 +190,37 @@ def main():
         for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
             print(f"  {tag}: {count} occurrences")
     
-    # Write detailed results to file
+    # Build the detailed results in memory and write them in one call
+    out = [
+        "# Removed tags at end of lines (NOT in allowed list)\n",
+        f"# Total removed: {len(all_removed)}\n",
+        f"# Unique tags: {len(tag_counts)}\n",
+        "#" + "=" * 59 + "\n\n",
+    ]
+    
+    # Summary section
+    out.append("## SUMMARY - Tags removed:\n")
+    out.extend(f"  {tag}: {count} occurrences\n"
+               for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]))
+    out.append("\n" + "=" * 60 + "\n\n")
+    
+    # Detailed locations
+    out.append("## DETAILED LOCATIONS:\n")
+    out.append("# Format: File path | File line | Dialogue # | Removed tag\n\n")
+    
+    # Group by file: the per-file results are already grouped, in sorted
+    # file order and ascending line order
+    for filepath, (removed, _) in zip(target_files, results):
+        if not removed:
+            continue
+        out.append(f"### {filepath}\n")
+        for file_line_num, dialogue_num, tag in removed:
+            dialogue_str = f"Dialogue {dialogue_num}" if dialogue_num else "N/A"
+            out.append(f"  Line {file_line_num} | {dialogue_str} | {tag}\n")
+        out.append("\n")
+    
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write("# Removed tags at end of lines (NOT in allowed list)\n")
-        f.write(f"# Total removed: {len(all_removed)}\n")
-        f.write(f"# Unique tags: {len(tag_counts)}\n")
-        f.write("#" + "=" * 59 + "\n\n")
-        
-        # Summary section
-        f.write("## SUMMARY - Tags removed:\n")
-        for tag, count in sorted(tag_counts.items(), key=lambda x: -x[1]):
-            f.write(f"  {tag}: {count} occurrences\n")
-        f.write("\n" + "=" * 60 + "\n\n")
-        
-        # Detailed locations
-        f.write("## DETAILED LOCATIONS:\n")
-        f.write("# Format: File path | File line | Dialogue # | Removed tag\n\n")
-        
-        # Group by file
-        by_file = defaultdict(list)
-        for filepath, file_line_num, dialogue_num, tag in all_removed:
-            by_file[filepath].append((file_line_num, dialogue_num, tag))
-        
-        for filepath in sorted(by_file.keys()):
-            f.write(f"### {filepath}\n")
-            for file_line_num, dialogue_num, tag in sorted(by_file[filepath]):
-                dialogue_str = f"Dialogue {dialogue_num}" if dialogue_num else "N/A"
-                f.write(f"  Line {file_line_num} | {dialogue_str} | {tag}\n")
-            f.write("\n")
+        f.write("".join(out))
     
     print(f"\nRemoval log written to: {output_file}")
 